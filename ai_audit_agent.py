@@ -2,17 +2,33 @@
 
 ## AI is skipped if not present. Remember this won't run with AI unless you install the right model and have it up and running. Use the provided script to do it easily. 
 
-import os, sys, re, json, subprocess, datetime, webbrowser
-from collections import Counter
+import os, sys, re, io, json, subprocess, datetime, hashlib, time, socket, http.client, urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import report_theme as theme
 
+# orjson is optional, it parses the log show rows a good deal faster when present
+try:
+    import orjson
+    _loads, _dumps = orjson.loads, orjson.dumps
+except ImportError:
+    _loads, _dumps = json.loads, lambda o: json.dumps(o).encode()
+
 STREAM = ("-stream" in sys.argv) or ("--stream" in sys.argv)
 OPEN_BROWSER = "--no-open" not in sys.argv
+USE_CACHE = "--no-cache" not in sys.argv
+REPLAY = "--replay" in sys.argv
 
 LLM_HOST  = os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434")
 LLM_MODEL = os.environ.get("OLLAMA_MODEL", "llama3.1")
 LLM_CTX   = int(os.environ.get("OLLAMA_NUM_CTX", "8192"))
 LLM_TO    = 90
+LLM_KEEP  = "30m"
+LOG_WORKERS = max(1, int(os.environ.get("AUDIT_WORKERS", "8")))
+
+CACHE_PATH = os.path.expanduser(os.environ.get("AUDIT_CACHE", "~/.macos_audit_cache.json"))
+CACHE_TTL  = 7*86400
+LOG_CACHE_DIR = ".audit_cache"
+LOG_CACHE_TTL = 86400
 
 NOW = datetime.datetime.now(datetime.timezone.utc)
 STAMP = NOW.strftime("%Y-%m-%d_%H%M")
@@ -45,33 +61,101 @@ def resolve_range(choice):
     else: start = end - datetime.timedelta(hours=1)
     return start.isoformat(), end.isoformat()
 
-def shquote(s): return "'" + s.replace("'", "'\\''") + "'"
+def _probe():
+    # Checked once per run, when the server is down every triage call short-circuits instead of timing out
+    u = urllib.parse.urlsplit(LLM_HOST)
+    try:
+        with socket.create_connection((u.hostname or "127.0.0.1", u.port or (443 if u.scheme == "https" else 80)), timeout=0.25): return True
+    except OSError: return False
+
+_OLLAMA_UP = _probe()
+_CONN = None
+
+def _conn():
+    # One keep-alive connection to Ollama for the whole run instead of a socket per call
+    global _CONN
+    if _CONN is None:
+        u = urllib.parse.urlsplit(LLM_HOST)
+        cls = http.client.HTTPSConnection if u.scheme == "https" else http.client.HTTPConnection
+        _CONN = cls(u.hostname or "127.0.0.1", u.port, timeout=LLM_TO)
+    return _CONN
+
+def _drop_conn():
+    global _CONN
+    if _CONN is not None: _CONN.close()
+    _CONN = None
 
 def _ollama(prompt:str, temperature=0.0):
-    req = {"model": LLM_MODEL, "options":{"temperature":temperature, "num_ctx": LLM_CTX}, "prompt": prompt, "stream": False}
+    if not _OLLAMA_UP: return "__LLM_ERROR__ down"
+    req = {"model": LLM_MODEL, "options":{"temperature":temperature, "num_ctx": LLM_CTX}, "prompt": prompt, "stream": False, "keep_alive": LLM_KEEP, "format": "json"}
+    path = urllib.parse.urlsplit(LLM_HOST).path.rstrip("/") + "/api/generate"
+    body = _dumps(req)
+    for attempt in (0, 1):
+        try:
+            c = _conn()
+            c.request("POST", path, body, {"Content-Type":"application/json"})
+            r = c.getresponse(); data = r.read()
+            if r.status != 200: return f"__LLM_ERROR__ HTTPError: {r.status} {r.reason}"
+            return _loads(data).get("response","").strip()
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError) as e:
+            # Server closed the idle keep-alive socket, reconnect once
+            _drop_conn()
+            if attempt: return f"__LLM_ERROR__ {type(e).__name__}: {e}"
+        except Exception as e:
+            _drop_conn()
+            return f"__LLM_ERROR__ {type(e).__name__}: {e}"
+
+_TRIAGE_KEYS = ("verdict","rationale","tags","confidence")
+
+def _cache_entry_ok(v):
+    return isinstance(v, dict) and isinstance(v.get("ts"), (int, float)) \
+        and isinstance(v.get("verdict_obj"), dict) and all(k in v["verdict_obj"] for k in _TRIAGE_KEYS)
+
+def _load_cache():
+    if not USE_CACHE: return {}
     try:
-        import urllib.request
-        r = urllib.request.Request(f"{LLM_HOST}/api/generate", data=json.dumps(req).encode(), headers={"Content-Type":"application/json"})
-        with urllib.request.urlopen(r, timeout=LLM_TO) as f:
-            return json.loads(f.read()).get("response","").strip()
-    except Exception as e:
-        return f"__LLM_ERROR__ {type(e).__name__}: {e}"
+        with open(CACHE_PATH) as f: data = json.load(f)
+    except Exception: return {}
+    # The file is user writable, drop anything that is not a well formed entry instead of trusting it
+    if not isinstance(data, dict): return {}
+    return {k: v for k, v in data.items() if _cache_entry_ok(v)}
 
-def ai_triage(category, evidence):
-    sys_prompt = ('You are a macOS blue-team auditor. Given CATEGORY and EVIDENCE (log/config snippets), '
-                  'return compact JSON only: verdict,rationale,tags,confidence. verdict ∈ '
-                  '["Benign Likely FP","Risk Needs Review","Fail Confirmed","Inconclusive"].')
-    body = _ollama(f"<<SYS>>{sys_prompt}<</SYS>>\nCATEGORY:\n{category}\nEVIDENCE:\n{evidence}\nRESPONSE:")
+_CACHE = _load_cache()
+
+def _save_cache():
+    if not USE_CACHE: return
+    now = time.time()
+    for k in [k for k, v in _CACHE.items() if now - v["ts"] >= CACHE_TTL]: del _CACHE[k]
     try:
-        obj = json.loads(body)
-        if all(k in obj for k in ("verdict","rationale","tags","confidence")): return obj
-    except Exception: pass
-    body2 = _ollama("JSON only with verdict,rationale,tags,confidence\n" + f"CATEGORY:\n{category}\nEVIDENCE:\n{evidence}\nRESPONSE:")
+        with open(CACHE_PATH, "w") as f: json.dump(_CACHE, f)
+    except OSError: pass
+
+# Kept byte-identical and first in every prompt so Ollama reuses the cached prefix across categories
+TRIAGE_SYS = ('You are a macOS blue-team auditor. Given CATEGORY and EVIDENCE (log/config snippets), '
+              'return compact JSON only: verdict,rationale,tags,confidence. verdict ∈ '
+              '["Benign Likely FP","Risk Needs Review","Fail Confirmed","Inconclusive"].')
+
+def _ask_triage(category, evidence):
+    body = _ollama(f"<<SYS>>{TRIAGE_SYS}<</SYS>>\nEVIDENCE:\n{evidence}\nCATEGORY:\n{category}\nRESPONSE:")
     try:
-        obj2 = json.loads(body2)
-        if all(k in obj2 for k in ("verdict","rationale","tags","confidence")): return obj2
-    except Exception: pass
-    return {"verdict":"Inconclusive","rationale":"Model returned non JSON.","tags":[],"confidence":"low"}
+        obj = json.loads(body)
+        if isinstance(obj, dict) and all(k in obj for k in _TRIAGE_KEYS): return obj
+    except json.JSONDecodeError: pass
+    return None
+
+def ai_triage(category, evidence):
+    # Verdicts are cached by content hash so an unchanged evidence window skips the model entirely
+    h = hashlib.sha256(f"{LLM_MODEL}|{LLM_CTX}|{category}|{evidence}".encode()).hexdigest()
+    hit = _CACHE.get(h)
+    if hit and time.time() - hit["ts"] < CACHE_TTL: return hit["verdict_obj"]
+    if not _OLLAMA_UP:
+        return {"verdict":"Inconclusive","rationale":f"Ollama not reachable at {LLM_HOST}.","tags":[],"confidence":"low"}
+    obj = _ask_triage(category, evidence)
+    if obj is None:
+        return {"verdict":"Inconclusive","rationale":"Model returned non JSON.","tags":[],"confidence":"low"}
+    _CACHE[h] = {"ts": time.time(), "verdict_obj": obj}
+    _save_cache()
+    return obj
 
 CATEGORIES = {
     "AUTH": [
@@ -98,66 +182,274 @@ CATEGORIES = {
     ],
 }
 
-def run_log_show(start_iso, end_iso, predicate):
-    cmd = f"/usr/bin/log show --info --debug --predicate {shquote(predicate)} --style json --start {shquote(start_iso)} --end {shquote(end_iso)}"
-    p = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    if p.returncode != 0: return []
+# One OR'd predicate per category so log show walks the store once per category, not once per predicate
+PREDICATES = {cat: " OR ".join(f"({pr})" for pr in preds) for cat, preds in CATEGORIES.items()}
+CMDS_BY_CAT = {cat: [f"log show --predicate {pr}"] for cat, pr in PREDICATES.items()}
+CMDS_HTML_BY_CAT = {cat: theme.html_commands(cmds) for cat, cmds in CMDS_BY_CAT.items()}
+# Flat (category, predicate, commands html, severity when hit) records walked by the scan and report loops
+CATEGORIES_FLAT = tuple((cat, PREDICATES[cat], CMDS_HTML_BY_CAT[cat], "high" if cat in ("PERSIST","SECURITY") else "medium")
+                        for cat in CATEGORIES)
+
+def _row(obj):
+    return (obj.get('timestamp',''), obj.get('processImagePath') or obj.get('senderImagePath') or obj.get('process',''), obj.get('eventMessage',''))
+
+def _log_show_window(start_iso, end_iso, predicate, limit):
+    # Stream rows as log show emits them and stop it once the caller has enough.
+    # ndjson gives one complete event per line, --style json is a pretty printed array.
+    argv = ["/usr/bin/log","show","--info","--debug","--predicate",predicate,"--style","ndjson","--start",start_iso,"--end",end_iso]
     rows = []
-    for ln in p.stdout.splitlines():
-        try:
-            obj = json.loads(ln)
-            rows.append((obj.get('timestamp',''), obj.get('processImagePath') or obj.get('senderImagePath') or obj.get('process',''), obj.get('eventMessage','')))
-        except Exception: continue
+    with subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as p:
+        for ln in p.stdout:
+            try: rows.append(_row(_loads(ln)))
+            except Exception: continue
+            if len(rows) >= limit:
+                p.terminate(); break
+    if p.returncode != 0 and len(rows) < limit: return None
+    return rows
+
+# (window at least this many hours, slice hours), slices sit on fixed local clock edges
+_SLICE_HOURS = ((48, 24), (12, 6), (0, 1))
+
+def _buckets(start_iso, end_iso):
+    # Whole slices share keys across re-runs; the partial slices at either end of the window, and
+    # any slice not yet over, are flagged so they are scanned live instead of cached
+    s, e = datetime.datetime.fromisoformat(start_iso), datetime.datetime.fromisoformat(end_iso)
+    hrs = next(h for lim, h in _SLICE_HOURS if e - s >= datetime.timedelta(hours=lim))
+    step, now = datetime.timedelta(hours=hrs), datetime.datetime.now(s.tzinfo)
+    out = []
+    while s < e:
+        edge = s.replace(hour=s.hour - s.hour % hrs, minute=0, second=0, microsecond=0)
+        nxt = min(edge + step, e)
+        out.append((s.isoformat(), nxt.isoformat(), s == edge and nxt == edge + step and nxt <= now)); s = nxt
+    return out
+
+def _cached_window(start_iso, end_iso, predicate, limit):
+    key = hashlib.blake2b(f"{predicate}|{start_iso}|{end_iso}|{limit}".encode(), digest_size=16).hexdigest()
+    path = os.path.join(LOG_CACHE_DIR, key + ".jsonl")
+    try:
+        if time.time() - os.path.getmtime(path) < LOG_CACHE_TTL:
+            with open(path, "rb") as f: return [tuple(_loads(ln)) for ln in f]
+    except (OSError, ValueError): pass
+    rows = _log_show_window(start_iso, end_iso, predicate, limit)
+    if rows is None: return []
+    try:
+        os.makedirs(LOG_CACHE_DIR, exist_ok=True)
+        with open(path, "wb") as f: f.write(b"".join(_dumps(r) + b"\n" for r in rows))
+    except OSError: pass
     return rows
 
+def _prune_log_cache():
+    # Reads only skip expired slices and replay dumps, this is what removes them
+    now = time.time()
+    try: ents = list(os.scandir(LOG_CACHE_DIR))
+    except OSError: return
+    for ent in ents:
+        try:
+            if (ent.name.endswith(".jsonl") or ent.name.startswith("raw_")) and now - ent.stat().st_mtime >= LOG_CACHE_TTL:
+                os.remove(ent.path)
+        except OSError: pass
+
+def run_log_show(start_iso, end_iso, predicate, limit=50):
+    if not USE_CACHE: return _log_show_window(start_iso, end_iso, predicate, limit) or []
+    rows = []
+    for b0, b1, whole in _buckets(start_iso, end_iso):
+        rows.extend(_cached_window(b0, b1, predicate, limit) if whole else _log_show_window(b0, b1, predicate, limit) or [])
+        if len(rows) >= limit: break
+    return rows[:limit]
+
+# --- Replay mode: dump the raw window once, then evaluate the predicates in process
+_TOK = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|(==|!=|\|\||&&|!)|([A-Za-z_]\w*(?:\[[cd]+\])?))')
+_STR_OPS = {
+    "CONTAINS":   lambda v, x: x in v,
+    "BEGINSWITH": lambda v, x: v.startswith(x),
+    "ENDSWITH":   lambda v, x: v.endswith(x),
+    "==":         lambda v, x: v == x,
+    "!=":         lambda v, x: v != x,
+}
+
+def compile_predicate(pred):
+    # Handles the log predicate subset used in CATEGORIES: field OP "literal" joined by AND / OR / NOT and parentheses
+    toks, pos = [], 0
+    while pos < len(pred.rstrip()):
+        m = _TOK.match(pred, pos)
+        if not m: raise ValueError(f"unsupported predicate near: {pred[pos:pos+20]!r}")
+        toks.append(("str", m.group(3).replace('\\"', '"')) if m.group(3) is not None else ("tok", m.group(0).strip()))
+        pos = m.end()
+    i = 0
+    def peek(): return toks[i][1] if i < len(toks) and toks[i][0] == "tok" else None
+    def take():
+        nonlocal i
+        if i >= len(toks): raise ValueError(f"predicate ends early: {pred!r}")
+        i += 1; return toks[i-1]
+    def expr():
+        parts = [term()]
+        while peek() in ("OR", "||"): take(); parts.append(term())
+        return parts[0] if len(parts) == 1 else (lambda o: any(f(o) for f in parts))
+    def term():
+        parts = [factor()]
+        while peek() in ("AND", "&&"): take(); parts.append(factor())
+        return parts[0] if len(parts) == 1 else (lambda o: all(f(o) for f in parts))
+    def factor():
+        if peek() in ("NOT", "!"):
+            take(); f = factor(); return lambda o: not f(o)
+        if peek() == "(":
+            take(); f = expr()
+            if peek() != ")": raise ValueError(f"unbalanced parentheses in {pred!r}")
+            take(); return f
+        field, op, lit = take()[1], take()[1], take()
+        op, _, mods = op.partition("[")
+        if lit[0] != "str" or op not in _STR_OPS: raise ValueError(f"unsupported comparison {field} {op} in {pred!r}")
+        fn, x = _STR_OPS[op], lit[1]
+        if "c" in mods:
+            x = x.lower(); return lambda o: fn((o.get(field) or "").lower(), x)
+        return lambda o: fn(o.get(field) or "", x)
+    f = expr()
+    if i != len(toks): raise ValueError(f"trailing tokens in {pred!r}")
+    return f
+
+# Dump file names carry the window they cover, row timestamps from log show sort as plain strings
+_RAW_FMT = "%Y%m%dT%H%M%S%f"
+_RAW_NAME = re.compile(r"raw_(\d{8}T\d{12})_(\d{8}T\d{12})\.ndjson")
+_TS_FMT = "%Y-%m-%d %H:%M:%S.%f"
+
+def _local(iso):
+    d = datetime.datetime.fromisoformat(iso)
+    return d.astimezone().replace(tzinfo=None) if d.tzinfo else d
+
+def _raw_dumps():
+    out = []
+    try: ents = list(os.scandir(LOG_CACHE_DIR))
+    except OSError: return out
+    for ent in ents:
+        m = _RAW_NAME.fullmatch(ent.name)
+        if m: out.append((datetime.datetime.strptime(m[1], _RAW_FMT), datetime.datetime.strptime(m[2], _RAW_FMT), ent.path))
+    return out
+
+def _raw_dump(s, e):
+    # Covers s..e, or s..now when the window runs into the future. None when log show fails
+    path = os.path.join(LOG_CACHE_DIR, f"raw_{s.strftime(_RAW_FMT)}_{min(e, datetime.datetime.now()).strftime(_RAW_FMT)}.ndjson")
+    info("Dumping raw log window for replay")
+    try:
+        os.makedirs(LOG_CACHE_DIR, exist_ok=True)
+        with open(path + ".part", "wb") as f:
+            subprocess.run(["/usr/bin/log","show","--info","--debug","--style","ndjson","--start",s.isoformat(),"--end",e.isoformat()],
+                           stdout=f, stderr=subprocess.DEVNULL, check=True)
+        os.replace(path + ".part", path)
+    except (OSError, subprocess.CalledProcessError) as ex:
+        info(f"Raw dump failed, falling back to log show per category: {ex}")
+        try: os.remove(path + ".part")
+        except OSError: pass
+        return None
+    return path
+
+def _raw_segments(start_iso, end_iso):
+    # Walks the window taking whichever existing dump reaches furthest, so a re-run only dumps the
+    # part past the newest dump. Returns (path, lo, hi) pieces or None when a dump failed
+    cur, e = _local(start_iso), _local(end_iso)
+    dumps, segs = _raw_dumps(), []
+    while cur < e:
+        best = max((d for d in dumps if d[0] <= cur < d[1]), key=lambda d: d[1], default=None)
+        if best is None:
+            path = _raw_dump(cur, e)
+            if path is None: return None
+            segs.append((path, cur, e)); break
+        segs.append((best[2], cur, min(best[1], e))); cur = best[1]
+    return segs
+
+def replay_scan(start_iso, end_iso, limit=50):
+    # One pass over the dumps feeds every category, each stops collecting at limit.
+    # An empty result sends every category through the normal scan
+    segs = _raw_segments(start_iso, end_iso)
+    if segs is None: return {}
+    matchers = [(cat, compile_predicate(pr)) for cat, pr, _, _ in CATEGORIES_FLAT]
+    found = {cat: [] for cat, _ in matchers}
+    for path, lo, hi in segs:
+        lo, hi = lo.strftime(_TS_FMT), hi.strftime(_TS_FMT)
+        with open(path, "rb") as f:
+            for ln in f:
+                try: obj = _loads(ln)
+                except Exception: continue
+                ts = obj.get("timestamp", "")[:26]
+                if ts < lo: continue
+                if ts >= hi: break
+                for cat, match in matchers:
+                    if len(found[cat]) < limit and match(obj): found[cat].append(_row(obj))
+                if all(len(v) >= limit for v in found.values()): return found
+    return found
+
+def _triage(cat, hits):
+    info(f"Triage {cat}")
+    if not hits: return [], "", ai_triage(cat, "No hits in the selected window.")
+    ev_lines = [f"{t} {p} {m}" for t,p,m in hits[:200]]
+    # Evidence is capped at 6000 bytes for the model and 4000 for the report, stop encoding once the cap is hit
+    buf = bytearray()
+    for ln in ev_lines:
+        if len(buf) >= 6000: break
+        buf += ln.encode() + b"\n"
+    return ev_lines, buf[:4000].decode("utf-8", "ignore"), ai_triage(cat, buf[:6000].decode("utf-8", "ignore"))
+
 def audit_once(start_iso, end_iso):
     info("Starting scan, this may take a moment")
-    kpi = Counter({"pass":0,"fail":0,"error":0,"manual":0})
-    sev_counts = Counter({"high":0,"medium":0,"low":0})
+    _prune_log_cache()
+    kpi = {"pass":0,"fail":0,"error":0,"manual":0}
+    sev_counts = {"high":0,"medium":0,"low":0}
     rows = []
 
-    with open(OUT_TXT, "w") as txt:
-        txt.write(f"AUDIT window {start_iso} .. {end_iso}\n")
-        for cat, preds in CATEGORIES.items():
-            info(f"{cat} ({len(preds)} predicates)")
-            hits = []
-            for pr in preds:
-                info(f"Scanning {cat} | {pr}")
-                hits.extend(run_log_show(start_iso, end_iso, pr)[:50])
-            if not hits:
-                ai = ai_triage(cat, f"No hits in window {start_iso}..{end_iso}.")
-                rows.append({"id":cat,"title":f"{cat} signals","severity":"medium",
-                             "commands":[f"log show --predicate {pr}" for pr in preds],"status":"executed-pass",
-                             "ai":ai,"rc":0,"out":"no hits","err":""})
-                kpi["pass"] += 1; sev_counts["medium"] += 1
-                continue
-            ev = "\n".join(f"{t} {p} {m}" for t,p,m in hits[:200])
-            ai = ai_triage(cat, ev[:6000])
-            rows.append({"id":cat,"title":f"{cat} signals","severity":"high" if cat in ("PERSIST","SECURITY") else "medium",
-                         "commands":[f"log show --predicate {pr}" for pr in preds],"status":"executed-fail",
-                         "ai":ai,"rc":0,"out":ev[:4000],"err":""})
-            kpi["fail"] += 1; sev_counts["high" if cat in ("PERSIST","SECURITY") else "medium"] += 1
-            txt.write(f"\n## {cat}\n")
-            for t,p,m in hits[:50]: txt.write(f"{t} {p} {m}\n")
+    # Scans fan out on LOG_WORKERS threads and every finished category goes straight to one triage
+    # thread, so model time overlaps the scans still running. A single thread also keeps the
+    # shared Ollama connection to one caller.
+    found = replay_scan(start_iso, end_iso, 50) if REPLAY else {}
+    triaged = {}
+    with ThreadPoolExecutor(max_workers=1) as llm, ThreadPoolExecutor(max_workers=LOG_WORKERS) as ex:
+        for cat, hits in found.items(): triaged[cat] = llm.submit(_triage, cat, hits)
+        futs = {ex.submit(run_log_show, start_iso, end_iso, pr, 50): cat for cat, pr, _, _ in CATEGORIES_FLAT if cat not in found}
+        for fut in as_completed(futs):
+            cat = futs[fut]
+            info(f"Scanned {cat}")
+            triaged[cat] = llm.submit(_triage, cat, fut.result())
+
+    # Reports are assembled in memory and written with one call each
+    txt = io.StringIO()
+    txt.write(f"AUDIT window {start_iso} .. {end_iso}\n")
+    for cat, _, cmds_html, hit_sev in CATEGORIES_FLAT:
+        ev_lines, out, ai = triaged[cat].result()
+        if not ev_lines:
+            rows.append({"id":cat,"title":f"{cat} signals","severity":"medium",
+                         "cmds_html":cmds_html,"status":"executed-pass",
+                         "ai":ai,"rc":0,"out":"no hits","err":""})
+            kpi["pass"] += 1; sev_counts["medium"] += 1
+            continue
+        rows.append({"id":cat,"title":f"{cat} signals","severity":hit_sev,
+                     "cmds_html":cmds_html,"status":"executed-fail",
+                     "ai":ai,"rc":0,"out":out,"err":""})
+        kpi["fail"] += 1; sev_counts[hit_sev] += 1
+        txt.write(f"\n## {cat}\n")
+        txt.write("\n".join(ev_lines[:50]) + "\n")
+
+    with open(OUT_TXT, "w", encoding="utf-8") as f: f.write(txt.getvalue())
 
     ai_index = min(100, kpi["fail"]*10 + sev_counts["high"]*3 + sev_counts["medium"])
 
-    with open(OUT_HTML, "w") as h:
-        h.write(theme.html_head("MacOS Audit Report", f"Window {start_iso} → {end_iso}", LLM_MODEL, LLM_CTX, unsafe=False))
-        h.write(theme.html_dashboard(kpi, sev_counts, ai_index))
-        h.write(theme.html_table_open("Execution summary"))
-        for r in rows:
-            h.write(theme.html_table_row(r["id"], r["title"], r["severity"], r["commands"], r["status"], r["ai"]["verdict"] if r.get("ai") else None))
-        h.write(theme.html_table_close())
-        h.write('<div class="section"><h2>Details</h2>')
-        for r in rows:
-            h.write(theme.html_rule_block(r["id"], r["title"], r["severity"], r["commands"], r["rc"], r["out"], r["err"], r.get("ai")))
-        h.write(theme.html_close())
+    h = io.StringIO()
+    h.write(theme.html_head("MacOS Audit Report", f"Window {start_iso} → {end_iso}", LLM_MODEL, LLM_CTX, unsafe=False))
+    h.write(theme.html_dashboard(kpi, sev_counts, ai_index))
+    h.write(theme.html_table_open("Execution summary"))
+    for r in rows:
+        h.write(theme.html_table_row(r["id"], r["title"], r["severity"], r["cmds_html"], r["status"], r["ai"]["verdict"] if r.get("ai") else None))
+    h.write(theme.html_table_close())
+    h.write('<div class="section"><h2>Details</h2>')
+    for r in rows:
+        h.write(theme.html_rule_block(r["id"], r["title"], r["severity"], r["cmds_html"], r["rc"], r["out"], r["err"], r.get("ai")))
+    h.write("</div>")
+    h.write(theme.html_close())
+    with open(OUT_HTML, "wb") as f: f.write(h.getvalue().encode("utf-8"))
 
     print(f"TXT report: {OUT_TXT}")
     print(f"HTML report: {OUT_HTML}")
     if OPEN_BROWSER:
-        try: webbrowser.open("file://" + os.path.abspath(OUT_HTML))
+        # Detached so the script exits without waiting on the browser launch
+        try: subprocess.Popen(["/usr/bin/open", os.path.abspath(OUT_HTML)], start_new_session=True,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         except Exception: pass
 
 def main():
@@ -1,6 +1,10 @@
 # report_theme.py
 # Minimal shared CSS and helpers for HTML reports
 
+import html as htmllib
+
+_esc = htmllib.escape
+
 THEME_CSS = """
 :root{
   --bg:#0b0f16; --panel:#121826; --muted:#9fb3c8; --text:#e6edf3; --ok:#2ecc71; --warn:#f1c40f; --err:#ff6b6b;
@@ -32,13 +36,15 @@ summary{cursor:pointer;color:#cfe1ff}
 kbd{background:#111827;border:1px solid #374151;border-bottom-width:2px;border-radius:6px;padding:1px 6px;font-size:12px}
 hr{border:0;border-top:1px solid var(--border);margin:18px 0}
 .footer{color:var(--muted);font-size:12px;margin:18px 0}
+.section{margin:18px 0}
 """
 
+def _card(label, val, cls):
+    return f'<div class="card"><span class="k {cls}">{label}</span><span class="v">{val}</span></div>'
+
 def dashboard_html(title, meta, counters):
     # meta: dict; counters: dict of label -> value
-    cards = []
-    for label, (val, cls) in counters.items():
-        cards.append(f'<div class="card"><span class="k {cls}">{label}</span><span class="v">{val}</span></div>')
+    cards = [_card(label, val, cls) for label, (val, cls) in counters.items()]
     meta_rows = " · ".join(f"<span class='small'>{k}: <b>{v}</b></span>" for k,v in meta.items())
     return f"""
 <div class="header"><h1>{title}</h1><span class="small">{meta_rows}</span></div>
@@ -47,9 +53,67 @@ def dashboard_html(title, meta, counters):
 </div>
 """
 
-def html_head(doc_title):
-    return f"""<!doctype html><html><head><meta charset="utf-8"><meta name="viewport" content="width=device-width,initial-scale=1">
-<title>{doc_title}</title><style>{THEME_CSS}</style></head><body><div class="container">"""
+# Invariant page and table chrome, interpolated once at import instead of per report
+_HEAD_PREFIX = """<!doctype html><html><head><meta charset="utf-8"><meta name="viewport" content="width=device-width,initial-scale=1">
+<title>"""
+_HEAD_SUFFIX = f"""</title><style>{THEME_CSS}</style></head><body><div class="container">"""
+_TABLE_HEAD = ('</h2><table><thead><tr><th>ID</th><th>Title</th>'
+               '<th>Severity</th><th>Commands</th><th>Status</th><th>AI verdict</th></tr></thead><tbody>')
+_TAIL = "</div><div class='container footer'>Generated locally. No network calls.</div></body></html>"
+
+def html_head(doc_title, subtitle=None, model=None, ctx=None, unsafe=False):
+    head = _HEAD_PREFIX + doc_title + _HEAD_SUFFIX
+    if subtitle is None: return head
+    # Audit style header: title plus window, model and execution mode
+    meta = [f"<span class='small'>{_esc(subtitle)}</span>"]
+    if model: meta.append(f"<span class='small'>Model: <b>{_esc(str(model))}</b> ctx {_esc(str(ctx))}</span>")
+    meta.append(f"<span class='small'>Mode: <b>{'unsafe' if unsafe else 'safe'}</b></span>")
+    return head + f'<div class="header"><h1>{_esc(doc_title)}</h1>{" · ".join(meta)}</div>'
+
+def html_dashboard(kpi, sev_counts, ai_index):
+    cards = [_card("Pass", kpi["pass"], "ok"), _card("Fail", kpi["fail"], "err"),
+             _card("Error", kpi["error"], "warn"), _card("Manual", kpi["manual"], ""),
+             _card("High", sev_counts["high"], "err"), _card("Medium", sev_counts["medium"], "warn"),
+             _card("Low", sev_counts["low"], "ok"),
+             _card("AI risk index", ai_index, "err" if ai_index >= 50 else "warn" if ai_index >= 20 else "ok")]
+    return f'<div class="panel"><div class="grid">{"".join(cards)}</div></div>'
+
+_STATUS_CLS = {"executed-pass":"pass", "executed-fail":"fail", "error":"err"}
+
+def html_table_open(title):
+    return '<div class="panel"><h2>' + _esc(title) + _TABLE_HEAD
+
+def html_commands(commands):
+    # Rendered once per command list by the caller, then shared by the table row and the rule block
+    return "<br>".join(["<code>" + _esc(c) + "</code>" for c in commands])
+
+def html_table_row(rid, title, severity, cmds_html, status, verdict):
+    return "".join(["<tr><td><b>", _esc(rid), "</b></td><td>", _esc(title),
+                    '</td><td><span class="sev">', _esc(severity), "</span></td><td>",
+                    cmds_html,
+                    '</td><td><span class="status ', _STATUS_CLS.get(status, ""), '">', _esc(status),
+                    "</span></td><td>", _esc(verdict) if verdict else "<i>n/a</i>", "</td></tr>"])
+
+def html_table_close():
+    return "</tbody></table></div>"
+
+def html_rule_block(rid, title, severity, cmds_html, rc, out, err, ai=None):
+    rid, title, severity = _esc(rid), _esc(title), _esc(severity)
+    s = [f'<div class="panel"><h3>{rid} <span class="sev">{severity}</span></h3><div class="small">{title}</div>']
+    s.append("<pre>" + cmds_html + "</pre>")
+    s.append(f"<b>exit {rc}</b>")
+    if out: s.append("<b>stdout</b><pre>" + _esc(out) + "</pre>")
+    if err: s.append("<b>stderr</b><pre>" + _esc(err) + "</pre>")
+    if ai:
+        verdict, confidence = _esc(str(ai.get("verdict",""))), _esc(str(ai.get("confidence","")))
+        tags = _esc(", ".join(map(str, ai.get("tags") or [])))
+        s.append(f'<details open><summary>AI verdict: <b>{verdict}</b> <span class="small">confidence {confidence}</span></summary>'
+                 f'<div>{_esc(str(ai.get("rationale","")))}</div><div class="small">{tags}</div></details>')
+    s.append("</div>")
+    return "".join(s)
 
 def html_tail():
-    return "</div><div class='container footer'>Generated locally. No network calls.</div></body></html>"
+    return _TAIL
+
+def html_close():
+    return html_tail()
@@ -4,7 +4,9 @@
 # Robust multi-line extraction (heredocs, backslash continuations, fenced blocks),
 # safe-by-default execution, per-command timeouts, and optional local LLM analysis via Ollama.
 
-import argparse, datetime, glob, json, os, re, shlex, subprocess, sys, textwrap, webbrowser
+import argparse, datetime, http.client, json, os, re, shlex, signal, subprocess, sys, tempfile, textwrap, threading, urllib.parse, webbrowser
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Dict, Tuple
 
 # --- Theme
@@ -19,6 +21,7 @@ except Exception:
 NOW = datetime.datetime.now(datetime.timezone.utc)
 STAMP = NOW.strftime("%Y-%m-%d_%H%M")
 STREAM = False
+CMD_CACHE = True
 
 # --- Execution safety
 _EXEC_WHITELIST_PREFIX = ("/",)
@@ -31,35 +34,34 @@ _EXEC_WHITELIST_CMDS = {
 # --- Regex for extraction
 _RE_FENCE = re.compile(r"```(?:bash|sh|zsh)?\s*\n(?P<body>.+?)\n```", re.DOTALL)
 _RE_PROMPT = re.compile(r"^\s*\$\s*(?P<cmd>.+?)\s*$")
+# Unanchored lazy search rescans the line from every offset, callers gate it on a cheap "<<" substring test
 _RE_HEREDOC_OPEN = re.compile(r"(?P<head>.+?)<<\s*(?P<tag>[A-Za-z0-9_]+)\s*$")
-def _RE_HEREDOC_TERM(tag): return re.compile(rf"^\s*{re.escape(tag)}\s*$")
+# Whole looks_executable test in one match: optional indent, not an assignment, then an absolute
+# path or a whitelisted command name as the first token
+_RE_EXEC = re.compile(r"^\s*(?![A-Za-z_][A-Za-z0-9_]*\s*=)(?:/|(?:"
+                      + "|".join(map(re.escape, sorted(_EXEC_WHITELIST_CMDS, key=len, reverse=True)))
+                      + r")(?:\s|$))")
+_RE_JSON_OBJ = re.compile(r"\{.*\}", re.DOTALL)
 
 def log(msg):
     if STREAM: print(msg, flush=True)
 
 def join_backslash_lines(s: str) -> str:
-    lines, out, buf = s.splitlines(), [], ""
-    for line in lines:
-        line_r = line.rstrip()
-        if not buf:
-            buf = line_r
-        else:
-            buf += line_r
-        if buf.endswith("\\"):
-            buf = buf[:-1]
+    # Continuation pieces are collected and joined once, not grown with repeated +=
+    out, chunk = [], []
+    for line in s.splitlines():
+        r = line.rstrip()
+        if r.endswith("\\"):
+            chunk.append(r[:-1])
             continue
-        out.append(buf); buf = ""
-    if buf: out.append(buf)
+        chunk.append(r)
+        out.append("".join(chunk)); chunk.clear()
+    tail = "".join(chunk)
+    if tail: out.append(tail)
     return "\n".join(out)
 
 def looks_executable(cmd: str) -> bool:
-    cmd = cmd.strip()
-    if not cmd or cmd.startswith("#"): return False
-    if re.match(r"^[A-Za-z_][A-Za-z0-9_]*\s*=\s*", cmd): return False  # assignment examples
-    token = cmd.split()[0]
-    if token.startswith(_EXEC_WHITELIST_PREFIX): return True
-    if token in _EXEC_WHITELIST_CMDS: return True
-    return False
+    return bool(cmd and _RE_EXEC.match(cmd))
 
 def extract_from_fences(text: str) -> List[str]:
     commands = []
@@ -69,11 +71,11 @@ def extract_from_fences(text: str) -> List[str]:
         i = 0
         while i < len(lines):
             line = lines[i]
-            h = _RE_HEREDOC_OPEN.search(line)
+            h = _RE_HEREDOC_OPEN.search(line) if "<<" in line else None
             if h:
                 head, tag = h.group("head").rstrip(), h.group("tag")
                 block = [line]; i += 1
-                while i < len(lines) and not _RE_HEREDOC_TERM(tag).match(lines[i]):
+                while i < len(lines) and lines[i].strip() != tag:
                     block.append(lines[i]); i += 1
                 if i < len(lines): block.append(lines[i])
                 cmd = "\n".join(block).strip()
@@ -94,11 +96,11 @@ def extract_from_free_text(text: str) -> List[str]:
         pm = _RE_PROMPT.match(raw)
         if pm:
             cand = pm.group("cmd")
-            h = _RE_HEREDOC_OPEN.search(cand)
+            h = _RE_HEREDOC_OPEN.search(cand) if "<<" in cand else None
             if h:
                 head, tag = h.group("head").rstrip(), h.group("tag")
                 block = [cand]; i += 1
-                while i < len(lines) and not _RE_HEREDOC_TERM(tag).match(lines[i]):
+                while i < len(lines) and lines[i].strip() != tag:
                     block.append(lines[i]); i += 1
                 if i < len(lines): block.append(lines[i])
                 cmd = "\n".join(block).strip()
@@ -106,11 +108,11 @@ def extract_from_free_text(text: str) -> List[str]:
                 i += 1; continue
             if looks_executable(cand): commands.append(cand)
             i += 1; continue
-        h = _RE_HEREDOC_OPEN.search(raw)
+        h = _RE_HEREDOC_OPEN.search(raw) if "<<" in raw else None
         if h:
             head, tag = h.group("head").rstrip(), h.group("tag")
             block = [raw]; i += 1
-            while i < len(lines) and not _RE_HEREDOC_TERM(tag).match(lines[i]):
+            while i < len(lines) and lines[i].strip() != tag:
                 block.append(lines[i]); i += 1
             if i < len(lines): block.append(lines[i])
             cmd = "\n".join(block).strip()
@@ -119,74 +121,179 @@ def extract_from_free_text(text: str) -> List[str]:
         i += 1
     return commands
 
-# --- XCCDF parsing (lxml optional, fallback to crude)
+# --- XCCDF parsing (streams Rule elements, lxml when available, else ElementTree)
+try:
+    from lxml import etree as _etree
+    _LXML = True
+except ImportError:
+    import xml.etree.ElementTree as _etree
+    _LXML = False
+
+def _local(tag) -> str:
+    # Namespace-free element name, works for XCCDF 1.1 and 1.2 alike
+    return tag.rpartition("}")[2] if isinstance(tag, str) else ""
+
+# One HTML parser for every check-content blob, recover=True takes bare fragments without a wrapper
+_HTMLP = _etree.HTMLParser(recover=True, encoding="utf-8") if _LXML else None
+
+def _check_text(cc) -> str:
+    cc_text = "".join(cc.itertext())
+    # Plain text has no markup to strip, only run the HTML pass when a tag could be present
+    if _HTMLP is not None and "<" in cc_text:
+        try:
+            cc_text = _etree.tostring(_etree.fromstring(cc_text.encode("utf-8","replace"), parser=_HTMLP),
+                                      method="text", encoding="unicode")
+        except Exception:
+            pass
+    return cc_text.replace("\r\n","\n")
+
+if _LXML:
+    # Compiled, namespace-agnostic XPath: libxml2 walks the Rule children in C
+    _XP_TITLE = _etree.XPath("./*[local-name()='title']")
+    _XP_CC = _etree.XPath("./*[local-name()='check']/*[local-name()='check-content']")
+
+    def _rule_parts(rule):
+        titles = _XP_TITLE(rule)
+        return (titles[-1] if titles else None), _XP_CC(rule)
+else:
+    def _rule_parts(rule):
+        title, ccs = None, []
+        for child in rule:
+            name = _local(child.tag)
+            if name == "title": title = child
+            elif name == "check": ccs.extend(cc for cc in child if _local(cc.tag) == "check-content")
+        return title, ccs
+
+def _rule_dict(rule) -> Dict:
+    rid = rule.get("id") or "UNKNOWN_ID"
+    title_el, ccs = _rule_parts(rule)
+    title = (title_el.text or "Untitled").strip() if title_el is not None else "Untitled"
+    # Normalized once here; interned so the report's tallies and chip lookups hit the identity fast path
+    sev, cmd_blocks = sys.intern((rule.get("severity") or "unknown").strip().lower()), []
+    for cc in ccs:
+        blob = _check_text(cc)
+        cmds = extract_from_fences(blob)
+        if not cmds: cmds = extract_from_free_text(blob)
+        cmd_blocks.extend(cmds)
+    return {"id":rid,"title":title,"severity":sev,"commands":cmd_blocks,"manual":not cmd_blocks}
+
+def _parse_rules_streaming(xccdf_path: str):
+    # Each Rule is handled as soon as it closes and then released, so peak memory stays bounded
+    if _LXML:
+        events = _etree.iterparse(xccdf_path, events=("end",), tag="{*}Rule", resolve_entities=False)
+    else:
+        events = _etree.iterparse(xccdf_path, events=("end",))
+    for _, elem in events:
+        if _local(elem.tag) != "Rule": continue
+        yield _rule_dict(elem)
+        elem.clear()
+        if _LXML:
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
 def extract_rules_from_xccdf(xccdf_path: str):
-    rules = []
-    try:
-        from lxml import etree, html as lxml_html
-        parser = etree.XMLParser(remove_blank_text=False, resolve_entities=False)
-        root = etree.parse(xccdf_path, parser)
-        ns = {"xccdf":"http://checklists.nist.gov/xccdf/1.2"}
-        for rule in root.findall(".//xccdf:Rule", namespaces=ns):
-            rid = rule.get("id") or "UNKNOWN_ID"
-            title_el = rule.find("xccdf:title", namespaces=ns)
-            title = (title_el.text or "").strip() if title_el is not None else "Untitled"
-            sev = (rule.get("severity") or "unknown").strip()
-            cmd_blocks, manual = [], False
-            for check in rule.findall("xccdf:check", namespaces=ns):
-                cc = check.find("xccdf:check-content", namespaces=ns)
-                if cc is None: continue
-                cc_text = "".join(cc.itertext(with_tail=True))
-                try:
-                    blob = lxml_html.fromstring(f"<div>{cc_text}</div>").text_content()
-                except Exception:
-                    blob = cc_text
-                blob = blob.replace("\r\n","\n")
-                cmds = extract_from_fences(blob)
-                if not cmds: cmds = extract_from_free_text(blob)
-                cmd_blocks.extend(cmds)
-            if not cmd_blocks: manual = True
-            rules.append({"id":rid,"title":title,"severity":sev,"commands":cmd_blocks,"manual":manual})
-    except Exception as e:
-        # Fallback: very simple pull of <check-content> text
-        import xml.etree.ElementTree as ET
-        root = ET.parse(xccdf_path).getroot()
-        for rule in root.iter():
-            if rule.tag.endswith("Rule"):
-                rid = rule.attrib.get("id","UNKNOWN_ID")
-                title = "Untitled"; sev = rule.attrib.get("severity","unknown")
-                for child in rule:
-                    if child.tag.endswith("title"): title = (child.text or "Untitled").strip()
-                cmd_blocks, manual = [], False
-                for check in rule:
-                    if check.tag.endswith("check"):
-                        for cc in check:
-                            if cc.tag.endswith("check-content"):
-                                blob = "".join(cc.itertext())
-                                blob = blob.replace("\r\n","\n")
-                                cmds = extract_from_fences(blob)
-                                if not cmds: cmds = extract_from_free_text(blob)
-                                cmd_blocks.extend(cmds)
-                if not cmd_blocks: manual = True
-                rules.append({"id":rid,"title":title,"severity":sev,"commands":cmd_blocks,"manual":manual})
-    return rules
-
-# --- Command runner with a real shell
-def run_cmd(cmd: str, timeout: int = 12) -> Tuple[int,str,str]:
+    return list(_parse_rules_streaming(xccdf_path))
+
+# --- Command runner, direct exec for plain commands, a real shell otherwise
+# Anything bash would expand, redirect, pipe, glob or continue has to go through bash
+_SHELL_CHARS = frozenset('|&;<>$`\\\n*?[]{}~#()!')
+
+def _needs_shell(cmd: str) -> bool:
+    return not _SHELL_CHARS.isdisjoint(cmd)
+
+def _run_group(argv: List[str], env: Dict, timeout: int) -> Tuple[int,str,str]:
+    # New session per check so a timeout kills the whole process group, not just the direct child,
+    # and start_new_session needs no Python preexec_fn callback in the forked child
+    with subprocess.Popen(argv, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          env=env, start_new_session=True) as p:
+        try:
+            out, err = p.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            try:
+                os.killpg(p.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            p.communicate()
+            raise
+    return p.returncode, out, err
+
+def _exec_cmd(cmd: str, timeout: int) -> Tuple[int,str,str]:
     env = os.environ.copy()
     env["ENV"] = ""; env["BASH_ENV"] = ""
-    # Feed the whole block to bash -lc so heredocs work
-    p = subprocess.run(
-        ["/bin/bash","-lc",cmd if cmd.endswith("\n") else cmd+"\n"],
-        text=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        env=env,
-        timeout=timeout
-    )
-    return p.returncode, p.stdout, p.stderr
+    argv = None
+    if not _needs_shell(cmd):
+        try:
+            argv = shlex.split(cmd)
+        except ValueError:
+            argv = None
+    if argv:
+        # Plain argv, no shell startup at all
+        try:
+            return _run_group(argv, env, timeout)
+        except FileNotFoundError:
+            return 127, "", f"{argv[0]}: command not found\n"
+        except PermissionError:
+            return 126, "", f"{argv[0]}: Permission denied\n"
+        except OSError:
+            pass  # e.g. ENOEXEC for a script without a shebang, bash knows how to run those
+    # Feed the whole block to bash -c so heredocs work (no -l, login profiles are not needed)
+    return _run_group(["/bin/bash","-c",cmd if cmd.endswith("\n") else cmd+"\n"], env, timeout)
+
+# Many rules share the same read-only probe, each distinct command runs once per process
+_CMD_RESULTS: Dict[str, Tuple[int,str,str]] = {}
+
+def run_cmd(cmd: str, timeout: int = 12) -> Tuple[int,str,str]:
+    if not CMD_CACHE: return _exec_cmd(cmd, timeout)
+    key = cmd.strip()
+    hit = _CMD_RESULTS.get(key)
+    if hit is not None: return hit
+    res = _CMD_RESULTS[key] = _exec_cmd(cmd, timeout)
+    return res
 
 # --- Ollama AI (optional, offline)
+_TLS = threading.local()
+
+def _ollama_conn(host: str, timeout: float) -> http.client.HTTPConnection:
+    # One keep-alive connection per worker thread, reused for every rule that thread judges.
+    # The timeout is applied per call since batch and single rule calls need different ones
+    c = getattr(_TLS, "conn", None)
+    if c is None:
+        u = urllib.parse.urlsplit(host)
+        cls = http.client.HTTPSConnection if u.scheme == "https" else http.client.HTTPConnection
+        c = _TLS.conn = cls(u.hostname or "127.0.0.1", u.port)
+    c.timeout = timeout
+    if c.sock is not None: c.sock.settimeout(timeout)
+    return c
+
+def _ollama_generate(host: str, data: Dict, timeout: float = 60) -> Dict:
+    path = urllib.parse.urlsplit(host).path.rstrip("/") + "/api/generate"
+    body = json.dumps(data).encode()
+    for attempt in (0, 1):
+        c = _ollama_conn(host, timeout)
+        try:
+            c.request("POST", path, body, {"Content-Type": "application/json"})
+            resp = c.getresponse(); raw = resp.read()
+            if resp.status != 200: raise OSError(f"Ollama HTTP {resp.status}")
+            return json.loads(raw)
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            # Idle keep-alive socket was closed by the server, reconnect once
+            c.close(); _TLS.conn = None
+            if attempt: raise
+        except Exception:
+            c.close(); _TLS.conn = None
+            raise
+
+# The report tallies on these, anything else from the model is treated as no answer
+_VERDICTS = frozenset({"pass","fail","inconclusive","needs_review"})
+
+def _clean_verdict(v):
+    # Model output goes straight into the report, coerce risk_note and tags to the types it renders.
+    # None when the verdict is missing or not one of _VERDICTS
+    if not isinstance(v, dict) or v.get("verdict") not in _VERDICTS: return None
+    tags = v.get("tags")
+    tags = tags if isinstance(tags, list) else [] if tags is None else [tags]
+    return {**v, "risk_note": str(v.get("risk_note") or ""), "tags": [str(t) for t in tags]}
+
 def ai_judge(rule: Dict, rc: int, out: str, err: str) -> Dict:
     host = os.getenv("OLLAMA_HOST","http://127.0.0.1:11434")
     model = os.getenv("OLLAMA_MODEL","llama3.1")
@@ -207,32 +314,98 @@ STDERR:
 Return JSON only."""
     try:
         data = {"model": model, "prompt": prompt, "stream": False, "options": {"temperature": 0.1}}
-        resp = subprocess.run(
-            ["curl","-fsS","-H","Content-Type: application/json","-d",json.dumps(data),f"{host}/api/generate"],
-            text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60
-        )
-        j = json.loads(resp.stdout)
+        j = _ollama_generate(host, data)
         txt = j.get("response","").strip()
         # Extract JSON if the model wrapped anything
-        m = re.search(r"\{.*\}", txt, re.DOTALL)
+        m = _RE_JSON_OBJ.search(txt)
         if m: txt = m.group(0)
-        return json.loads(txt)
+        obj = _clean_verdict(json.loads(txt))
+        if obj is not None: return obj
     except Exception:
-        return {"verdict":"inconclusive","risk_note":"AI unavailable or non-JSON","tags":["ai-fallback"]}
+        pass
+    return {"verdict":"inconclusive","risk_note":"AI unavailable or non-JSON","tags":["ai-fallback"]}
+
+# Batches are capped by rule count and by serialized evidence size so the prompt fits num_ctx
+AI_BATCH_RULES = 20
+AI_BATCH_CHARS = 16000
+# A batch generates an answer per rule, so it gets the single rule timeout plus some time per rule
+AI_BATCH_TIMEOUT_PER_RULE = 15
+
+def _last_evidence(row: Dict) -> Dict:
+    return row["evidence"][-1] if row["evidence"] else {"cmd":"","rc":0,"stdout":"","stderr":""}
+
+def _ai_batches(rows: List[Dict]):
+    batch, size = [], 0
+    for r in rows:
+        last = _last_evidence(r)
+        item = {"id":r["id"],"title":r["title"],"severity":r["severity"],"exit":last["rc"],
+                "stdout":last["stdout"][:2000],"stderr":last["stderr"][:1000]}
+        n = len(json.dumps(item))
+        if batch and (len(batch) >= AI_BATCH_RULES or size + n > AI_BATCH_CHARS):
+            yield batch; batch, size = [], 0
+        batch.append((r, item)); size += n
+    if batch: yield batch
+
+def ai_judge_batch(items: List[Dict]) -> Dict[str, Dict]:
+    # One generate call for many rules, the shared instructions are prefilled once per batch.
+    # Transport errors and timeouts propagate; an unparseable answer yields {} so callers can go per rule.
+    host = os.getenv("OLLAMA_HOST","http://127.0.0.1:11434")
+    model = os.getenv("OLLAMA_MODEL","llama3.1")
+    prompt = f"""You are a macOS compliance assistant. Analyze these STIG rule results and return strict JSON.
+Return an object {{"results": [...]}} with one entry per input, fields: id (copied from the input), verdict (one of: "pass","fail","inconclusive","needs_review"), risk_note (short), tags (array of 1-4 short labels).
+
+Inputs:
+{json.dumps(items, indent=1)}
+Return JSON only."""
+    data = {"model": model, "prompt": prompt, "stream": False, "format": "json",
+            "options": {"temperature": 0.1, "num_ctx": int(os.getenv("OLLAMA_NUM_CTX","8192"))}}
+    j = _ollama_generate(host, data, 60 + AI_BATCH_TIMEOUT_PER_RULE*len(items))
+    try:
+        obj = json.loads(j.get("response","").strip())
+    except ValueError:
+        return {}
+    arr = obj.get("results", []) if isinstance(obj, dict) else obj
+    if not isinstance(arr, list): return {}
+    out = {}
+    for v in arr:
+        c = _clean_verdict(v)
+        if c is not None and "id" in c: out[str(c.pop("id"))] = c
+    return out
+
+def judge_results(results: List[Dict]) -> None:
+    for batch in _ai_batches(results):
+        log(f"AI batch of {len(batch)} rules")
+        try:
+            verdicts = ai_judge_batch([item for _, item in batch])
+        except Exception:
+            verdicts = None  # Ollama unreachable or too slow, a per rule retry would fail the same way
+        for r, _ in batch:
+            v = verdicts.get(r["id"]) if verdicts is not None else None
+            if v is None and verdicts is not None:
+                last = _last_evidence(r)
+                v = ai_judge(r, last["rc"], last["stdout"], last["stderr"])
+            r["ai"] = v or {"verdict":"inconclusive","risk_note":"AI unavailable or non-JSON","tags":["ai-fallback"]}
 
 # --- HTML builders # Should use the theme? 
 def status_class(verdict: str) -> str:
     return {"pass":"pass","fail":"fail","needs_review":"warn","inconclusive":"err"}.get(verdict,"err")
 
-def render_report_html(title: str, meta: Dict, rows: List[Dict]) -> str:
+# Severity chips for the common values, built once instead of per row
+_LOWISH = frozenset({"low","informational"})
+_SEV_HTML = {sev: f'<span class="sev">{sev}</span>' for sev in ("high","medium","low","informational","unknown")}
+
+def iter_report_html(title: str, meta: Dict, rows: List[Dict]):
+    # Yields the report in pieces, main joins them into the single buffer write_atomic replaces the file with
     total = len(rows)
-    pass_n = sum(1 for r in rows if r["ai"]["verdict"]=="pass")
-    fail_n = sum(1 for r in rows if r["ai"]["verdict"]=="fail")
-    review_n = sum(1 for r in rows if r["ai"]["verdict"]=="needs_review")
-    err_n = sum(1 for r in rows if r["ai"]["verdict"]=="inconclusive")
-    sev_high = sum(1 for r in rows if r["severity"].lower()=="high")
-    sev_med = sum(1 for r in rows if r["severity"].lower()=="medium")
-    sev_low = sum(1 for r in rows if r["severity"].lower()=="low" or r["severity"].lower()=="informational")
+    # One pass over the rows for every tally
+    verdicts, sevs = Counter(), Counter()
+    for r in rows:
+        verdicts[r["ai"]["verdict"]] += 1
+        sevs[r["severity"]] += 1
+    pass_n, fail_n = verdicts["pass"], verdicts["fail"]
+    review_n, err_n = verdicts["needs_review"], verdicts["inconclusive"]
+    sev_high, sev_med = sevs["high"], sevs["medium"]
+    sev_low = sum(sevs[s] for s in _LOWISH)
 
     counters = {
         "Rules": (total,""),
@@ -241,50 +414,70 @@ def render_report_html(title: str, meta: Dict, rows: List[Dict]) -> str:
         "Needs review": (review_n,"warn"),
         "Inconclusive": (err_n,""),
     }
-    dash = dashboard_html(title, meta, counters)
+    yield html_head(title)
+    yield dashboard_html(title, meta, counters)
+    yield '<div class="panel"><table><thead><tr><th>Rule</th><th>Severity</th><th>AI Verdict</th><th>Commands</th><th>Evidence</th></tr></thead><tbody>'
 
-    table_rows = []
     for r in rows:
         sev = r["severity"]
         verdict = r["ai"]["verdict"]
         note = r["ai"].get("risk_note","")
         tags = ", ".join(r["ai"].get("tags",[]))
         cmd_html = "".join(f"<pre><code>{escape_html(c)}</code></pre>" for c in r["commands"]) if r["commands"] else "<i>manual</i>"
-        ev_html = ""
+        ev_html = []
         for ev in r["evidence"]:
-            ee = f"<details><summary><code>$ {escape_html(first_line(ev['cmd']))}</code> <span class='small'>(exit {ev['rc']})</span></summary>"
+            ev_html.append(f"<details><summary><code>$ {escape_html(first_line(ev['cmd']))}</code> <span class='small'>(exit {ev['rc']})</span></summary>")
             if ev["stdout"].strip():
-                ee += f"<b>stdout</b><pre>{escape_html(ev['stdout'])}</pre>"
+                ev_html.append(f"<b>stdout</b><pre>{escape_html(ev['stdout'])}</pre>")
             if ev["stderr"].strip():
-                ee += f"<b>stderr</b><pre>{escape_html(ev['stderr'])}</pre>"
-            ee += "</details>"
-            ev_html += ee
-        table_rows.append(f"""
+                ev_html.append(f"<b>stderr</b><pre>{escape_html(ev['stderr'])}</pre>")
+            ev_html.append("</details>")
+        yield f"""
 <tr>
   <td><div><b>{escape_html(r['id'])}</b><div class="small">{escape_html(r['title'])}</div></div></td>
-  <td><span class="sev">{escape_html(sev)}</span></td>
+  <td>{_SEV_HTML.get(sev) or f'<span class="sev">{escape_html(sev)}</span>'}</td>
   <td><span class="status {status_class(verdict)}">{escape_html(verdict)}</span><div class="small">{escape_html(note)}{(' · '+escape_html(tags)) if tags else ''}</div></td>
   <td>{cmd_html}</td>
-  <td>{ev_html}</td>
+  <td>{"".join(ev_html)}</td>
 </tr>
-""")
+"""
+
+    yield "</tbody></table></div>"
+    yield html_tail()
 
-    html = []
-    html.append(html_head(title))
-    html.append(dash)
-    html.append('<div class="panel"><table><thead><tr><th>Rule</th><th>Severity</th><th>AI Verdict</th><th>Commands</th><th>Evidence</th></tr></thead><tbody>')
-    html.extend(table_rows)
-    html.append("</tbody></table></div>")
-    html.append(html_tail())
-    return "".join(html)
+_HTML_ESCAPE_MAP = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"})
 
 def escape_html(s: str) -> str:
-    return (s or "").replace("&","&amp;").replace("<","&lt;").replace(">","&gt;")
+    # Single C-level pass instead of one replace() per character class
+    return (s or "").translate(_HTML_ESCAPE_MAP)
 
 def first_line(s: str) -> str:
-    return (s or "").splitlines()[0] if s else ""
+    return s.partition("\n")[0] if s else ""
 
 # --- Runner
+def _run_one(r: Dict, allow_unsafe: bool, timeout: int, debug: bool) -> Tuple[Dict, Dict]:
+    log(f"{r['id']} :: {r['title']}")
+    counts = {"executed":0,"manual":0,"errors":0}
+    ev = []
+    if not r["commands"]:
+        counts["manual"] += 1
+    for c in r["commands"]:
+        # safety: block dangerous non-whitelisted bare commands if unsafe not allowed
+        head = c.strip().split()[0]
+        if not allow_unsafe and not (head.startswith("/") or head in _EXEC_WHITELIST_CMDS):
+            ev.append({"cmd": c, "rc": 127, "stdout": "", "stderr": "blocked by safe mode"})
+            counts["errors"] += 1
+            continue
+        if debug:
+            sys.stderr.write("\n--- EXEC ---\n" + c + "\n-----------\n")
+        try:
+            rc, out, err = run_cmd(c, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            rc, out, err = 124, "", "timeout"
+        counts["executed"] += 1
+        ev.append({"cmd": c, "rc": rc, "stdout": out, "stderr": err})
+    return {"id":r["id"],"title":r["title"],"severity":r["severity"],"commands":r["commands"],"evidence":ev}, counts
+
 def run_rules(rules: List[Dict], ids: List[str], keyword: str, allow_unsafe: bool, timeout: int, debug: bool) -> Tuple[List[Dict], Dict]:
     selected = []
     if ids:
@@ -296,37 +489,38 @@ def run_rules(rules: List[Dict], ids: List[str], keyword: str, allow_unsafe: boo
     else:
         selected = rules
 
-    results = []
+    # Checks mostly wait on subprocesses, so rules run on a thread pool; results keep the rule order
+    results = [None] * len(selected)
     counts = {"executed":0,"manual":0,"errors":0}
-    for r in selected:
-        log(f"{r['id']} :: {r['title']}")
-        ev = []
-        if not r["commands"]:
-            counts["manual"] += 1
-        for c in r["commands"]:
-            # safety: block dangerous non-whitelisted bare commands if unsafe not allowed
-            head = c.strip().split()[0]
-            if not allow_unsafe and not (head.startswith("/") or head in _EXEC_WHITELIST_CMDS):
-                ev.append({"cmd": c, "rc": 127, "stdout": "", "stderr": "blocked by safe mode"})
-                counts["errors"] += 1
-                continue
-            if debug:
-                sys.stderr.write("\n--- EXEC ---\n" + c + "\n-----------\n")
-            try:
-                rc, out, err = run_cmd(c, timeout=timeout)
-            except subprocess.TimeoutExpired:
-                rc, out, err = 124, "", "timeout"
-            counts["executed"] += 1
-            ev.append({"cmd": c, "rc": rc, "stdout": out, "stderr": err})
-
-        # AI verdict from last evidence primarily, else manual
-        last = ev[-1] if ev else {"cmd":"","rc":0,"stdout":"","stderr":""}
-        ai = ai_judge(r, last["rc"], last["stdout"], last["stderr"])
-        results.append({"id":r["id"],"title":r["title"],"severity":r["severity"],"commands":r["commands"],"evidence":ev,"ai":ai})
+    workers = max(1, int(os.getenv("STIG_WORKERS", "8")))
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futs = {ex.submit(_run_one, r, allow_unsafe, timeout, debug): i for i, r in enumerate(selected)}
+        for fut in as_completed(futs):
+            results[futs[fut]], delta = fut.result()
+            for k, v in delta.items(): counts[k] += v
+    # AI verdicts (from each rule's last evidence) once all commands are done, batched across rules
+    judge_results(results)
     return results, counts
 
+def write_atomic(path: str, data: bytes) -> None:
+    # Whole report in one buffer, written to a temp file beside it and renamed into place
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        os.fchmod(fd, 0o644)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        os.close(fd); fd = -1
+        os.replace(tmp, path)
+    except BaseException:
+        if fd >= 0: os.close(fd)
+        os.unlink(tmp)
+        raise
+
 def discover_xccdf_files() -> List[str]:
-    return sorted(glob.glob("*.xml")) + sorted(glob.glob("*.xccdf.xml"))
+    # One directory scan; *.xccdf.xml is already covered by *.xml, so nothing is listed twice
+    with os.scandir(".") as it:
+        return sorted(e.name for e in it if not e.name.startswith(".") and e.name.lower().endswith(".xml") and e.is_file())
 
 def interactive_select(files: List[str]) -> str:
     print("STIG Runner")
@@ -350,10 +544,12 @@ def main():
     ap.add_argument("--timeout", type=int, default=12, help="Per-command timeout seconds")
     ap.add_argument("--stream", action="store_true", help="Print progress as it runs")
     ap.add_argument("--no-open", action="store_true", help="Do not open HTML in browser")
+    ap.add_argument("--no-cmd-cache", action="store_true", help="Re-run identical commands instead of reusing the first result")
     ap.add_argument("--debug-commands", action="store_true", help="Print exact command blocks before execution to stderr")
     args = ap.parse_args()
-    global STREAM
+    global STREAM, CMD_CACHE
     STREAM = args.stream
+    CMD_CACHE = not args.no_cmd_cache
 
     xccdf = args.xccdf
     if not xccdf:
@@ -375,22 +571,20 @@ def main():
     txt_path  = f"stig_{STAMP}.txt"
 
     # TXT
-    with open(txt_path,"w",encoding="utf-8") as f:
-        f.write(f"STIG Runner\nGenerated UTC {NOW.strftime('%Y-%m-%d %H:%M')}, Source {base}\n\n")
-        for r in results:
-            f.write(f"{r['id']} [{r['severity']}] {r['title']}\n")
-            f.write(f"AI verdict: {r['ai'].get('verdict')} - {r['ai'].get('risk_note')}\n")
-            for ev in r["evidence"]:
-                f.write(f"$ {first_line(ev['cmd'])} (exit {ev['rc']})\n")
-                if ev["stdout"].strip(): f.write(ev["stdout"]+"\n")
-                if ev["stderr"].strip(): f.write(ev["stderr"]+"\n")
-            f.write("\n")
+    txt = [f"STIG Runner\nGenerated UTC {NOW.strftime('%Y-%m-%d %H:%M')}, Source {base}\n\n"]
+    for r in results:
+        txt.append(f"{r['id']} [{r['severity']}] {r['title']}\n")
+        txt.append(f"AI verdict: {r['ai'].get('verdict')} - {r['ai'].get('risk_note')}\n")
+        for ev in r["evidence"]:
+            txt.append(f"$ {first_line(ev['cmd'])} (exit {ev['rc']})\n")
+            if ev["stdout"].strip(): txt.append(ev["stdout"]+"\n")
+            if ev["stderr"].strip(): txt.append(ev["stderr"]+"\n")
+        txt.append("\n")
+    write_atomic(txt_path, "".join(txt).encode("utf-8"))
 
     # HTML
     meta = {"Generated UTC": NOW.strftime("%Y-%m-%d %H:%M"), "Source": base}
-    html = render_report_html("STIG Runner", meta, results)
-    with open(html_path,"w",encoding="utf-8") as f:
-        f.write(html)
+    write_atomic(html_path, "".join(iter_report_html("STIG Runner", meta, results)).encode("utf-8"))
 
     print(f"TXT report: {txt_path}")
     print(f"HTML report: {html_path}")